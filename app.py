@@ -1,11 +1,19 @@
 import asyncio
+import atexit
+import concurrent.futures
+import csv
+import io
 import json
+import queue
+import threading
 import time
-from dataclasses import dataclass, asdict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
 from typing import Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import httpx
+import pandas as pd
 import streamlit as st
 
 st.set_page_config(page_title="AI Crawler Access Tester", page_icon="🤖", layout="wide")
@@ -24,6 +32,24 @@ CRAWLER_UAS: Dict[str, str] = {
 }
 
 BLOCK_STATUS = {401, 403, 405, 406, 409, 410, 429, 451}
+BODY_SCAN_BYTES = 2000  # classify_block never looks past this much body
+# HTTP/1.1 only hands a socket back to the pool once the body is read to the end, so
+# bodies up to this size (on the wire) are drained; bigger ones cost the connection.
+BODY_DRAIN_BYTES = 64 * 1024
+ROBOTS_TTL_S = 600
+ROBOTS_TIMEOUT_S = 10
+LOOP_WAIT_MARGIN_S = 5  # slack on top of request timeouts before the script thread gives up waiting
+MAX_HISTORY = 200  # results kept per session; older ones are dropped
+MAX_IN_FLIGHT = 5  # concurrent crawler requests per batch, well under the keep-alive pool
+# History is one DataFrame with these columns (plus a row "id"); EXPORT_KEYS names the same fields, in order, for CSV/JSON
+ROW_KEYS = ("Crawler", "Input URL", "Final URL", "HTTP", "Blocked", "Reason", "Elapsed (ms)", "Cached")
+EXPORT_KEYS = ("crawler", "input_url", "final_url", "status", "blocked", "reason", "elapsed_ms", "cached")
+
+# Matched against the raw lower-cased body bytes, so the scan never decodes UTF-8
+CHALLENGE_MARKERS = (
+    b"access denied", b"forbidden", b"not authorized", b"verify you are human",
+    b"cloudflare", b"akamai", b"perimeterx", b"attention required",
+)
 
 
 @dataclass
@@ -39,6 +65,14 @@ class FetchResult:
     body_sample: str
 
 
+def to_row(row_id: int, r: Dict, cached: bool) -> Dict:
+    # EXPORT_KEYS[:-1] are FetchResult's field names, in table order
+    row = dict(zip(ROW_KEYS, [r[k] for k in EXPORT_KEYS[:-1]] + [cached]))
+    row["id"] = row_id
+    return row
+
+
+@lru_cache(maxsize=256)
 def normalize_url(u: str) -> str:
     u = u.strip()
     if not u:
@@ -49,68 +83,71 @@ def normalize_url(u: str) -> str:
     return parsed.geturl()
 
 
-def classify_block(status: int, body_text: str, headers: Dict[str, str]) -> Tuple[str, str]:
-    text = (body_text or "")[:2000].lower()
+def classify_block(status: int, body: bytes, headers: Dict[str, str]) -> Tuple[str, str]:
     if status in BLOCK_STATUS:
         return ("true", f"HTTP {status}")
-    if any(k in text for k in [
-        "access denied", "forbidden", "not authorized", "verify you are human",
-        "cloudflare", "akamai", "perimeterx", "attention required"
-    ]):
+    low = body[:BODY_SCAN_BYTES].lower()
+    if any(k in low for k in CHALLENGE_MARKERS):
         return ("possible", "Challenge / mitigation text detected")
-    if "x-robots-tag" in {k.lower() for k in headers.keys()}:
+    if "x-robots-tag" in headers:
         return ("false", "x-robots-tag present (informational)")
     return ("false", "OK")
 
 
-async def fetch_once(client: httpx.AsyncClient, url: str, ua: str, method: str):
-    r = await client.request(
-        method, url,
+async def fetch_once(client: httpx.AsyncClient, url: str, ua: str, timeout_s: float):
+    async with client.stream(
+        "GET", url,
         headers={
             "user-agent": ua,
             "accept": "*/*",
             "accept-language": "en",
             "cache-control": "no-cache",
-        }
-    )
-    body = await r.aread() if method == "GET" else b""
-    headers = {k: ", ".join(v) if isinstance(v, list) else str(v) for k, v in r.headers.items()}
-    body_text = body.decode("utf-8", errors="ignore") if body else ""
-    return r.status_code, str(r.url), headers, body_text
+        },
+        timeout=timeout_s,
+    ) as r:
+        status, final_url = r.status_code, str(r.url)
+        headers = dict(r.headers.items())
+        scan = status not in BLOCK_STATUS  # a blocking status decides the verdict on its own
+        # HTTP/2 just resets the stream on an early exit, so only HTTP/1.1 is drained
+        limit = BODY_SCAN_BYTES if scan else 0
+        if r.http_version == "HTTP/1.1" and int(r.headers.get("content-length") or 0) <= BODY_DRAIN_BYTES:
+            limit = BODY_DRAIN_BYTES
+        body = bytearray()
+        if limit:
+            async for chunk in r.aiter_bytes():
+                if scan and len(body) < BODY_SCAN_BYTES:
+                    body += chunk
+                if len(body) >= limit or r.num_bytes_downloaded >= limit:
+                    break
+    # the last chunk can overshoot the cap; only the scanned prefix is kept
+    return status, final_url, headers, bytes(body[:BODY_SCAN_BYTES])
 
 
-async def test_crawler(url: str, crawler: str, ua: str, timeout_s: float = 15.0) -> FetchResult:
+async def test_crawler(client: httpx.AsyncClient, url: str, crawler: str, ua: str,
+                       timeout_s: float = 15.0) -> FetchResult:
     url = normalize_url(url)
-    limits = httpx.Limits(max_keepalive_connections=5, max_connections=10)
-    async with httpx.AsyncClient(
-        follow_redirects=True, http2=True, timeout=timeout_s, limits=limits
-    ) as client:
-        try:
-            with st.spinner(f"Testing {crawler}…"):
-                t0 = time.perf_counter()
-                try:
-                    status, final_url, headers, body = await fetch_once(client, url, ua, "HEAD")
-                    if status >= 400 or status == 405:
-                        status, final_url, headers, body = await fetch_once(client, url, ua, "GET")
-                except httpx.HTTPError:
-                    status, final_url, headers, body = await fetch_once(client, url, ua, "GET")
-                elapsed_ms = int((time.perf_counter() - t0) * 1000)
-
-                blocked, reason = classify_block(status, body, headers)
-                return FetchResult(crawler, url, final_url, status, blocked, reason,
-                                   elapsed_ms, headers, body[:500] or "")
-        except Exception as e:
-            return FetchResult(crawler, url, url, 0, "unknown", f"Fetch failed: {e}",
-                               0, {}, "")
-
-
-@st.cache_data(show_spinner=False, ttl=600)
-def fetch_robots_txt(base_url: str) -> Optional[str]:
-    base = normalize_url(base_url)
     try:
-        parsed = urlparse(base)
-        robots = f"{parsed.scheme}://{parsed.netloc}/robots.txt"
-        r = httpx.get(robots, headers={"user-agent": "Mozilla/5.0"}, timeout=10)
+        t0 = time.perf_counter()
+        status, final_url, headers, body = await fetch_once(client, url, ua, timeout_s)
+        elapsed_ms = int((time.perf_counter() - t0) * 1000)
+
+        blocked, reason = classify_block(status, body, headers)
+        return FetchResult(crawler, url, final_url, status, blocked, reason,
+                           elapsed_ms, headers, body[:500].decode("utf-8", errors="ignore"))
+    except Exception as e:
+        return FetchResult(crawler, url, url, 0, "unknown", f"Fetch failed: {e}",
+                           0, {}, "")
+
+
+def robots_url(base_url: str) -> str:
+    parsed = urlparse(normalize_url(base_url))
+    return f"{parsed.scheme}://{parsed.netloc}/robots.txt"
+
+
+async def fetch_robots_async(client: httpx.AsyncClient, base_url: str) -> str:
+    try:
+        r = await client.get(robots_url(base_url), headers={"user-agent": "Mozilla/5.0"},
+                             timeout=ROBOTS_TIMEOUT_S)
         if r.status_code < 400:
             return r.text[:10000]
         return f"(HTTP {r.status_code})"
@@ -118,6 +155,161 @@ def fetch_robots_txt(base_url: str) -> Optional[str]:
         return f"(Error: {e})"
 
 
+async def run_all(client: httpx.AsyncClient, url: str, crawlers: List[str],
+                  timeout_s: float = 15.0, with_robots: bool = True,
+                  done: Optional["queue.Queue[str]"] = None) -> Tuple[List[FetchResult], Optional[str]]:
+    # httpx's pool lock degrades under many concurrent requests, so cap this batch's fetches
+    sem = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def _tracked(crawler: str) -> FetchResult:
+        try:
+            # acquired before test_crawler starts its clock, so queueing isn't counted as latency
+            async with sem:
+                return await test_crawler(client, url, crawler, CRAWLER_UAS[crawler], timeout_s)
+        finally:
+            if done is not None:
+                done.put(crawler)
+
+    # one gather over one client: with HTTP/2 on, every crawler and robots.txt share a single
+    # connection; on HTTP/1.1 a socket is reused only after a fully drained response (see fetch_once)
+    tasks = [_tracked(c) for c in crawlers]
+    if with_robots:
+        tasks.append(fetch_robots_async(client, url))
+    results = await asyncio.gather(*tasks)
+    if with_robots:
+        return results[:-1], results[-1]
+    return results, None
+
+
+# ---- Shared client ----
+# An AsyncClient's connection pool is bound to the event loop it runs on, so the
+# process-wide clients live on one long-lived loop in a background thread.
+@dataclass
+class CrawlerLoop:
+    loop: asyncio.AbstractEventLoop
+    thread: threading.Thread
+    clients: List[httpx.AsyncClient]
+
+    async def _shutdown(self) -> None:
+        # cancel in-flight batches first so no caller waits on a future that never resolves
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*[c.aclose() for c in self.clients], return_exceptions=True)
+
+    def close(self) -> None:
+        if not self.loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        if not self.thread.is_alive():
+            self.loop.close()
+
+
+@st.cache_resource
+def get_crawler_loop() -> CrawlerLoop:
+    # "Clear cache" drops cached resources without releasing them, so first shut
+    # down any loop (and its clients' sockets) left running by an earlier entry.
+    for t in threading.enumerate():
+        old = getattr(t, "crawler_loop", None)
+        if old is not None:
+            old.close()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name="crawler-loop", daemon=True)
+    handle = CrawlerLoop(loop, thread, [])
+    thread.crawler_loop = handle
+    thread.start()
+    atexit.register(handle.close)
+    return handle
+
+
+def run_async(coro, timeout_s: float):
+    future = asyncio.run_coroutine_threadsafe(coro, get_crawler_loop().loop)
+    try:
+        return future.result(timeout=timeout_s + LOOP_WAIT_MARGIN_S)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
+
+
+@st.cache_resource
+def get_client(http2: bool = False) -> httpx.AsyncClient:
+    client = httpx.AsyncClient(
+        follow_redirects=True, http2=http2, timeout=httpx.Timeout(15.0),
+        # keep more idle sockets than there are crawlers so none is evicted mid-batch; HTTP/1.1
+        # sockets only come back here after fetch_once drains the body (BODY_DRAIN_BYTES)
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=300),
+    )
+    # closed by its own loop's handle, on that loop, at exit or on the next cache clear
+    get_crawler_loop().clients.append(client)
+    return client
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def run_tests(url: str, crawlers: Tuple[str, ...], timeout_s: float, http2: bool = False,
+              with_robots: bool = True) -> Tuple[List[Dict], Optional[str], float]:
+    # Returned with the results so callers can tell a cache hit from a fresh probe
+    fetched_at = time.time()
+    # The loop thread has no Streamlit context, so it only reports finished crawlers
+    # through a queue and this (script) thread drives the one progress bar.
+    done: "queue.Queue[str]" = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(
+        run_all(get_client(http2), url, list(crawlers), timeout_s, with_robots, done),
+        get_crawler_loop().loop,
+    )
+    # crawlers run in waves of MAX_IN_FLIGHT; httpx timeouts are per phase, so allow one extra wave
+    waves = -(-len(crawlers) // MAX_IN_FLIGHT)
+    limit_s = max(timeout_s, ROBOTS_TIMEOUT_S) * (waves + 1) + LOOP_WAIT_MARGIN_S
+    deadline = time.monotonic() + limit_s
+    bar = st.progress(0.0, text=f"Testing {len(crawlers)} crawler(s)…")
+    finished = 0
+    while finished < len(crawlers):
+        try:
+            crawler = done.get(timeout=0.1)
+        except queue.Empty:
+            if future.done() or time.monotonic() > deadline:
+                break
+            continue
+        finished += 1
+        bar.progress(finished / len(crawlers), text=f"{crawler} done ({finished}/{len(crawlers)})")
+    bar.empty()
+    try:
+        results, robots = future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise RuntimeError(f"Crawler batch did not finish within {limit_s:.0f} s") from None
+    # plain dicts: st.cache_data pickles the return value, and FetchResult lives in a
+    # __main__ that Streamlit replaces on every script run
+    return [asdict(r) for r in results], robots, fetched_at
+
+
+@st.cache_data(show_spinner=False, ttl=ROBOTS_TTL_S)
+def fetch_robots_txt(base_url: str, http2: bool = False) -> Optional[str]:
+    try:
+        return run_async(fetch_robots_async(get_client(http2), base_url), ROBOTS_TIMEOUT_S)
+    except Exception as e:
+        return f"(Error: {e})"
+
+
+def build_exports(history: pd.DataFrame, headers: Dict[int, Dict[str, str]],
+                  bodies: Dict[int, str]) -> Tuple[bytes, bytes]:
+    rows = history.iloc[::-1]  # newest first, as in the table
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_KEYS)
+    w.writerows(rows[list(ROW_KEYS)].itertuples(index=False))
+    records = [{**dict(zip(EXPORT_KEYS, (r[k] for k in ROW_KEYS))),
+                "headers": headers.get(r["id"], {}), "body_sample": bodies.get(r["id"], "")}
+               for r in rows.to_dict("records")]
+    return buf.getvalue().encode("utf-8"), json.dumps(records, indent=2).encode("utf-8")
+
+
 # ---- UI ----
 st.title("🤖 AI Crawler Access Tester")
 st.caption("Send requests with popular AI crawler User-Agents to see how your site responds. "
@@ -129,11 +321,20 @@ with st.sidebar:
     chosen_bots = st.multiselect("AI crawlers to simulate", list(CRAWLER_UAS.keys()),
                                  default=["GPTBot", "OAI-SearchBot"])
     timeout = st.slider("Timeout (seconds)", 5, 30, 15)
+    use_http2 = st.checkbox("Use HTTP/2", value=False, key="use_http2",
+                            help="Multiplexes all crawlers over one connection on h2 origins; "
+                                 "plain HTTP/1.1 skips the h2 negotiation for one-shot tests.")
     show_robots = st.checkbox("Show robots.txt (informational)", value=True)
     run_btn = st.button("Run tests", type="primary")
 
 if "history" not in st.session_state:
-    st.session_state.history: List[Dict] = []
+    st.session_state.history = pd.DataFrame(columns=[*ROW_KEYS, "id"])
+    st.session_state.history_version = 0
+    st.session_state.exports: Tuple[int, bytes, bytes] = (-1, b"", b"")  # (history_version, csv, json)
+    st.session_state.robots: Dict[str, Tuple[float, str]] = {}
+    st.session_state.headers: Dict[int, Dict[str, str]] = {}  # by row id
+    st.session_state.bodies: Dict[int, str] = {}  # by row id, latest batch only
+    st.session_state.next_row_id = 0
 
 if run_btn:
     if not url.strip():
@@ -141,66 +342,69 @@ if run_btn:
     elif not chosen_bots:
         st.error("Pick at least one crawler.")
     else:
-        coros = [test_crawler(url, b, CRAWLER_UAS[b], timeout) for b in chosen_bots]
-
-        async def _run_all():
-            return await asyncio.gather(*coros)
-
-        results: List[FetchResult] = asyncio.run(_run_all())
-        for r in results:
-            st.session_state.history.append(asdict(r))
-        st.success("Done!")
+        started = time.time()
+        results, robots, fetched_at = run_tests(url, tuple(chosen_bots), timeout, use_http2, show_robots)
+        cached = fetched_at < started
+        first_id = st.session_state.next_row_id
+        st.session_state.next_row_id += len(results)
+        rows = [to_row(first_id + i, r, cached) for i, r in enumerate(results)]
+        # one concat per batch keeps the history table built instead of re-projecting it each rerun
+        new_rows = pd.DataFrame(rows, columns=[*ROW_KEYS, "id"])
+        if not st.session_state.history.empty:
+            new_rows = pd.concat([st.session_state.history, new_rows], ignore_index=True)
+        st.session_state.history = new_rows.iloc[-MAX_HISTORY:]
+        oldest_id = st.session_state.history["id"].iloc[0]
+        st.session_state.headers = {k: v for k, v in st.session_state.headers.items() if k >= oldest_id}
+        st.session_state.headers.update((first_id + i, r["headers"]) for i, r in enumerate(results))
+        # only the latest batch keeps its body sample; older ones are dropped to save memory
+        st.session_state.bodies = {first_id + i: r["body_sample"] for i, r in enumerate(results)}
+        st.session_state.history_version += 1
+        if robots is not None:  # only the latest origin is kept, so this never grows
+            st.session_state.robots = {robots_url(url): (fetched_at, robots)}
+        if cached:
+            st.info(f"Same test ran {int(started - fetched_at)} s ago; showing cached results "
+                    "(marked Cached). Run again after a minute for a fresh probe.")
+        else:
+            st.success("Done!")
 
 # ---- Results ----
-if st.session_state.history:
+if not st.session_state.history.empty:
     st.subheader("Results")
-    table_rows = list(reversed(st.session_state.history))
-    st.dataframe(
-        [{
-            "Crawler": r["crawler"],
-            "Input URL": r["input_url"],
-            "Final URL": r["final_url"],
-            "HTTP": r["status"],
-            "Blocked": r["blocked"],
-            "Reason": r["reason"],
-            "Elapsed (ms)": r["elapsed_ms"],
-        } for r in table_rows],
-        use_container_width=True,
-        hide_index=True
-    )
+    st.dataframe(st.session_state.history.iloc[::-1], column_order=ROW_KEYS,
+                 use_container_width=True, hide_index=True)
 
     st.divider()
     st.subheader("Details")
-    for r in table_rows[:20]:
-        with st.expander(f'{r["crawler"]} → {r["final_url"]} (HTTP {r["status"]}, blocked={r["blocked"]})'):
+    for r in st.session_state.history.iloc[:-21:-1].to_dict("records"):  # newest 20
+        with st.expander(f'{r["Crawler"]} → {r["Final URL"]} (HTTP {r["HTTP"]}, blocked={r["Blocked"]})'):
             cols = st.columns(3)
             with cols[0]:
-                st.write("**Input URL**", r["input_url"])
-                st.write("**Final URL**", r["final_url"])
-                st.write("**HTTP**", r["status"])
-                st.write("**Blocked**", r["blocked"])
-                st.write("**Reason**", r["reason"])
-                st.write("**Elapsed (ms)**", r["elapsed_ms"])
+                for k in ROW_KEYS[1:]:
+                    st.write(f"**{k}**", r[k])
             with cols[1]:
                 st.write("**Response headers**")
-                st.json(r["headers"])
+                st.json(st.session_state.headers.get(r["id"], {}))
             with cols[2]:
                 st.write("**Body sample**")
-                st.code(r["body_sample"] or "(no body)")
+                st.code(st.session_state.bodies.get(r["id"]) or "(no body)")
 
     st.divider()
     st.subheader("Export")
-    csv_data = "crawler,input_url,final_url,status,blocked,reason,elapsed_ms\n" + "\n".join(
-        f'{r["crawler"]},"{r["input_url"]}","{r["final_url"]}",{r["status"]},{r["blocked"]},"{r["reason"].replace(",", ";")}",{r["elapsed_ms"]}'
-        for r in table_rows
-    )
-    st.download_button("Download CSV", data=csv_data.encode("utf-8"),
+    # rebuilt only when history changed, so plain widget reruns reuse this session's bytes
+    if st.session_state.exports[0] != st.session_state.history_version:
+        st.session_state.exports = (st.session_state.history_version,
+                                    *build_exports(st.session_state.history, st.session_state.headers,
+                                                   st.session_state.bodies))
+    _, csv_data, json_data = st.session_state.exports
+    st.download_button("Download CSV", data=csv_data,
                        file_name="crawler_results.csv", mime="text/csv")
-    json_data = json.dumps(table_rows, indent=2)
-    st.download_button("Download JSON", data=json_data.encode("utf-8"),
+    st.download_button("Download JSON", data=json_data,
                        file_name="crawler_results.json", mime="application/json")
 
 if show_robots and url.strip():
     st.divider()
     st.subheader("robots.txt (informational only)")
-    st.code(fetch_robots_txt(url) or "(none)")
+    fetched_at, robots = st.session_state.robots.get(robots_url(url), (0.0, None))
+    if time.time() - fetched_at > ROBOTS_TTL_S:
+        robots = fetch_robots_txt(url, use_http2)
+    st.code(robots or "(none)")